@@ -1,25 +1,99 @@
+import bisect
+import json
 import os
 import re
+import time
 import streamlit as st
 import asyncio
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+# uvloop substantially lowers per-callback overhead in the streaming hot
+# path; fall back silently where it is unavailable (e.g. Windows)
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, ToolMessage
 from chatbot import CodeExplorerChatbot
 from config import CODEBASE_PATH, BATCH_SIZE, logger
 
-# New method: Load existing knowledge base
-def load_knowledge_base() -> str:
-    kb_path = os.path.join(CODEBASE_PATH, 'knowledge_base.md')
+# Minimum seconds between streamed-response placeholder updates
+STREAM_FLUSH_INTERVAL = 0.05
+
+# Characters of tool output shown before requiring "Show full output"
+TOOL_OUTPUT_PREVIEW_CHARS = 4096
+
+# Static sidebar copy, hoisted so reruns reuse the same string objects
+ABOUT_TEXT = """
+    This Code Explorer helps you navigate and understand codebases.
+
+    **Features:**
+    - Explore file structure
+    - Read file contents
+    - Ask questions about code
+    """
+
+TIPS_TEXT = """
+    - Start by asking about the overall structure
+    - Ask specific questions about functionality
+    - Inquire about specific files or components
+    """
+
+# New method: Load existing knowledge base.
+# The parse itself is a plain function so it can run off the main thread
+# during session init; the cached wrapper is keyed on (path, mtime) so reruns
+# hit memory and invalidate automatically when the KB file is appended to.
+def _parse_knowledge_base(kb_path: str) -> str:
     try:
-        if os.path.exists(kb_path):
-            with open(kb_path, 'r', encoding='utf-8') as f:
+        with open(kb_path, 'r', encoding='utf-8') as f:
+            if not kb_path.endswith('.jsonl'):
                 return f.read()
+            # Append-only JSONL: replay snapshot/delta records in order
+            content = ""
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record.get("type") == "snapshot":
+                    content = record.get("content", "")
+                elif record.get("type") == "delta":
+                    content += record.get("patch", "")
+            return content or "None"
     except Exception as e:
         logger.error(f"Error loading knowledge base: {e}")
     return "None"
 
-# Define initial prompt with file structure and instructions
-initial_prompt = f"""
+def _locate_kb_file():
+    # Prefer the append-only JSONL store; fall back to the legacy .md file
+    for name in ('knowledge_base.jsonl', 'knowledge_base.md'):
+        kb_path = os.path.join(CODEBASE_PATH, name)
+        if os.path.exists(kb_path):
+            return kb_path
+    return None
+
+@st.cache_data(show_spinner=False)
+def _read_knowledge_base(kb_path: str, mtime: float) -> str:
+    return _parse_knowledge_base(kb_path)
+
+def load_knowledge_base() -> str:
+    kb_path = _locate_kb_file()
+    if kb_path is None:
+        return "None"
+    return _read_knowledge_base(kb_path, os.path.getmtime(kb_path))
+
+# Define initial prompt with file structure and instructions.
+# Keyed on the KB file's (path, mtime) like _read_knowledge_base, so a
+# regenerated knowledge base reaches new conversations without a restart
+# while unchanged reruns still skip the formatting.
+@st.cache_data(show_spinner=False)
+def _build_initial_prompt(kb_path, kb_mtime) -> str:
+    return f"""
 You are a technical assistant specialized in analyzing and explaining codebases through EVIDENCE-BASED exploration. Your expertise lies in navigating, understanding, and explaining code through direct observation rather than speculation.
 
 ## CORE PRINCIPLES
@@ -52,6 +126,11 @@ Here is the knowledge base generated last time.
 Remember to be conversational while maintaining technical precision. Adapt your explanation depth to match the user's apparent technical expertise.
 """
 
+def get_initial_prompt() -> str:
+    kb_path = _locate_kb_file()
+    kb_mtime = os.path.getmtime(kb_path) if kb_path else 0.0
+    return _build_initial_prompt(kb_path, kb_mtime)
+
 # ## RESPONSE STRUCTURE
 
 # When answering user queries:
@@ -69,34 +148,97 @@ Remember to be conversational while maintaining technical precision. Adapt your
 st.title("Code Explorer Chatbot")
 st.write("Explore your codebase with AI assistance")
 
-# Initialize session state for configuration
+# Build the pydantic message object once per prompt text instead of
+# re-validating it for every session's first turn; a regenerated KB
+# changes the prompt, which keys a fresh message
+@st.cache_resource(show_spinner=False)
+def _system_message_for(prompt: str) -> SystemMessage:
+    return SystemMessage(content=prompt)
+
+def get_system_message():
+    return _system_message_for(get_initial_prompt())
+
+# One chatbot instance is shared process-wide; sessions are isolated by
+# their checkpointer thread_id, so tabs don't each pay graph compilation
+# and model-client setup.
+@st.cache_resource
+def get_chatbot():
+    return CodeExplorerChatbot(CODEBASE_PATH)
+
+# Initialize session state for configuration.
+# The KB read (pure I/O) runs on a worker thread while the chatbot is
+# fetched/constructed, so the cold start costs roughly the longer of the
+# two instead of their sum.
 if "config" not in st.session_state:
-    st.session_state.config = {"configurable": {"thread_id": "1", "recursion_limit": 50}}
-    st.session_state.chatbot = CodeExplorerChatbot(CODEBASE_PATH)
-    if load_knowledge_base():
-        st.session_state.chatbot.app.update_state(st.session_state.config, {"knowledge_base": load_knowledge_base()})
+    st.session_state.config = {"configurable": {"thread_id": uuid.uuid4().hex, "recursion_limit": 50}}
+    kb_path = _locate_kb_file()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        kb_future = pool.submit(_parse_knowledge_base, kb_path) if kb_path else None
+        st.session_state.chatbot = get_chatbot()
+        kb = kb_future.result() if kb_future else "None"
+    # The loader returns the sentinel "None" (truthy) when no KB exists;
+    # skip the checkpointer write in that case
+    if kb and kb != "None":
+        st.session_state.chatbot.app.update_state(st.session_state.config, {"knowledge_base": kb})
+    # Start the session's background event loop up front so the first turn
+    # doesn't pay loop/thread creation on top of first-token latency
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    st.session_state.event_loop = loop
+    st.session_state.loop_thread = loop_thread
+
+# Function to get current state from checkpoint.
+# The snapshot is read once per script run and memoized; the script is
+# re-executed from the top on every rerun, so the cache never goes stale.
+_state_snapshot = None
 
-# Function to get current state from checkpoint
 def get_current_state():
-    snapshot = st.session_state.chatbot.app.get_state(st.session_state.config)
-    if snapshot and hasattr(snapshot, 'values'):
-        return snapshot.values
-    return {"messages": [], "all_files_opened": []}
+    global _state_snapshot
+    if _state_snapshot is None:
+        snapshot = st.session_state.chatbot.app.get_state(st.session_state.config)
+        if snapshot and hasattr(snapshot, 'values'):
+            _state_snapshot = snapshot.values
+        else:
+            _state_snapshot = {"messages": [], "all_files_opened": []}
+    return _state_snapshot
+
+# Generate a preview of tool message content.
+# Previews are memoized per message id: tool messages are immutable once
+# created, and re-slicing large tool outputs on every call is wasted work.
+_preview_cache = {}
 
-# Generate a preview of tool message content
 def generate_tool_preview(msg):
     if not isinstance(msg, ToolMessage):
         return None
-    
+    key = getattr(msg, "id", None) or id(msg)
+    if key in _preview_cache:
+        return _preview_cache[key]
+    preview = _build_tool_preview(msg)
+    _preview_cache[key] = preview
+    return preview
+
+def _build_tool_preview(msg):
     content = str(msg.content)
     metadata = msg.additional_kwargs.get("metadata", {})
     tool_name = metadata.get("tool_name", "tool")
     
     if tool_name == "get_file_structure":
-        structure_size = metadata.get("structure_size", 0)
-        lines = content.split('\n')
-        preview = '\n'.join(lines[:5]) + (f"\n... ({structure_size-5} more lines)" if structure_size > 5 else "")
-        return f"📁 **File Structure** (showing {min(5, structure_size)} of {structure_size} lines)"
+        # Locate the first five lines with bounded find() calls; the
+        # (potentially huge) structure output is never split into a list
+        end = 0
+        shown = 0
+        while shown < 5:
+            nxt = content.find('\n', end)
+            if nxt == -1:
+                end = len(content)
+                shown += 1 if end > 0 else 0
+                break
+            end = nxt + 1
+            shown += 1
+        excerpt = content[:end].rstrip('\n')
+        structure_size = metadata.get("structure_size") or content.count('\n') + 1
+        return f"📁 **File Structure** (showing {min(shown, structure_size)} of {structure_size} lines)\n{excerpt}"
     
     elif tool_name == "open_files":
         files = metadata.get("files", [])
@@ -111,57 +253,128 @@ def generate_tool_preview(msg):
         return f"🔧 **Tool Response** ({len(content)} characters)"
     return f"🔧 **Tool Response**: {content[:100]}"
 
+# Flatten message content (string or list of typed chunks) to plain text.
+# Exact type checks are deliberate: content chunks are plain dicts/strs from
+# the SDK, and `type(...) is` avoids isinstance's subclass walk per chunk.
+def _text_of(content):
+    if type(content) is str:
+        return content
+    if type(content) is list:
+        return "".join(
+            chunk["text"] for chunk in content
+            if type(chunk) is dict and chunk.get("type") == "text"
+        )
+    return str(content)
+
 # Convert LangChain message to format suitable for UI display
+def _display_system(msg):
+    return None  # Skip system messages
+
+def _display_tool(msg):
+    return {
+        "role": "tool",
+        "content": str(msg.content),
+        "preview": generate_tool_preview(msg),
+        # Widget keys derive from this: message ids are stable while loop
+        # indices shift whenever the visible window grows
+        "id": getattr(msg, "id", None) or id(msg),
+    }
+
+def _display_assistant(msg):
+    return {"role": "assistant", "content": _text_of(msg.content)}
+
+def _display_user(msg):
+    return {"role": "user", "content": _text_of(msg.content)}
+
+# Exact-type dispatch: one dict lookup per message instead of an isinstance
+# chain; subclasses (e.g. message chunks) fall back to the generic path below
+_DISPLAY_HANDLERS = {
+    SystemMessage: _display_system,
+    ToolMessage: _display_tool,
+    AIMessage: _display_assistant,
+    HumanMessage: _display_user,
+}
+
 def convert_message_for_display(msg):
+    handler = _DISPLAY_HANDLERS.get(type(msg))
+    if handler is not None:
+        return handler(msg)
     if isinstance(msg, SystemMessage):
-        return None  # Skip system messages
-    
+        return _display_system(msg)
     if isinstance(msg, ToolMessage):
-        return {
-            "role": "tool",
-            "content": str(msg.content),
-            "preview": generate_tool_preview(msg)
-        }
-    
+        return _display_tool(msg)
     role = "assistant" if isinstance(msg, AIMessage) else "user"
-    
-    # Extract content based on type
-    if isinstance(msg.content, list):
-        content = "".join(
-            chunk["text"] for chunk in msg.content 
-            if isinstance(chunk, dict) and chunk.get("type") == "text"
-        )
-    else:
-        content = str(msg.content)
-        
-    return {"role": role, "content": content}
+    return {"role": role, "content": _text_of(msg.content)}
+
+# Convert messages for display, reusing previously converted ones.
+# Conversion (content flattening + tool previews) is cached per message id in
+# session state, so each rerun only pays for messages added since the last one.
+def get_display_messages(messages):
+    # Fast path: if the visible window is unchanged since the last rerun
+    # (same length and same tail message), reuse the whole converted list
+    fingerprint = (len(messages), getattr(messages[-1], "id", None) if messages else None)
+    cached = st.session_state.get("display_list_cache")
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    cache = st.session_state.setdefault("display_cache", {})
+    display_msgs = []
+    for msg in messages:
+        msg_id = getattr(msg, "id", None)
+        if msg_id is not None and msg_id in cache:
+            display_msgs.append(cache[msg_id])
+            continue
+        display_msg = convert_message_for_display(msg)
+        if msg_id is not None:
+            cache[msg_id] = display_msg
+        display_msgs.append(display_msg)
+    st.session_state.display_list_cache = (fingerprint, display_msgs)
+    return display_msgs
+
+# Fetch only the recent tail of the conversation for display. MemorySaver
+# cannot slice on the storage side, so the tail is taken right after the
+# snapshot read; older turns stay in the checkpoint as an archive and are
+# pulled in only when the user widens the window.
+def get_recent_messages(k):
+    messages = get_current_state().get("messages", [])
+    return len(messages), messages[-k:] if k else messages
+
+# Display conversation history from checkpoint.
+# Only the most recent window of messages is rendered; older turns stay
+# available behind a button so long threads don't slow down every rerun.
+HISTORY_WINDOW_STEP = 25
 
-# Display conversation history from checkpoint
 current_state = get_current_state()
-for msg in current_state.get("messages", []):
-    display_msg = convert_message_for_display(msg)
+st.session_state.setdefault("history_window", HISTORY_WINDOW_STEP)
+total_messages, visible_history = get_recent_messages(st.session_state.history_window)
+if total_messages > st.session_state.history_window:
+    hidden_count = total_messages - st.session_state.history_window
+    if st.button(f"Load {min(HISTORY_WINDOW_STEP, hidden_count)} earlier messages ({hidden_count} hidden)"):
+        st.session_state.history_window += HISTORY_WINDOW_STEP
+        st.rerun()
+for display_msg in get_display_messages(visible_history):
     if not display_msg:  # Skip system messages
         continue
-        
+
     with st.chat_message(display_msg["role"] if display_msg["role"] != "tool" else "assistant"):
         if display_msg["role"] == "tool":
-            # Display collapsible tool message
+            # Display collapsible tool message. Large tool outputs are
+            # truncated by default so every rerun doesn't ship the full
+            # payload over the websocket; a toggle reveals the rest.
             with st.expander(display_msg["preview"]):
-                st.code(display_msg["content"])
+                tool_content = display_msg["content"]
+                if len(tool_content) > TOOL_OUTPUT_PREVIEW_CHARS and not st.toggle(
+                    "Show full output", key=f"show_full_tool_{display_msg['id']}"
+                ):
+                    st.code(tool_content[:TOOL_OUTPUT_PREVIEW_CHARS] + "…")
+                else:
+                    st.code(tool_content)
         else:
             # Regular message display
             st.markdown(display_msg["content"])
 # Add sidebar with information and files explored
 with st.sidebar:
     st.header("About")
-    st.info("""
-    This Code Explorer helps you navigate and understand codebases.
-    
-    **Features:**
-    - Explore file structure
-    - Read file contents
-    - Ask questions about code
-    """)
+    st.info(ABOUT_TEXT)
     
     # Debug info checkbox
     if st.checkbox("Show Debug Info"):
@@ -179,23 +392,32 @@ with st.sidebar:
     files_opened = get_current_state().get("all_files_opened", [])
     if files_opened:
         st.header("📁 Files Explored")
-        sorted_files = sorted(set(files_opened))
-        
-        # Group files by directory for better organization
-        file_tree = {}
-        for file in sorted_files:
-            parts = file.split('/')
-            if len(parts) > 1:
-                directory = '/'.join(parts[:-1])
-                filename = parts[-1]
-                if directory not in file_tree:
-                    file_tree[directory] = []
-                file_tree[directory].append(filename)
-            else:
-                if "root" not in file_tree:
-                    file_tree["root"] = []
-                file_tree["root"].append(file)
-        
+
+        # The raw list only ever grows, so instead of re-sorting it each
+        # rerun, insort just the entries appended since the last pass into a
+        # persistent sorted list
+        files_cache = st.session_state.setdefault(
+            "files_sorted_cache", {"processed": 0, "seen": set(), "sorted": []}
+        )
+        for file in files_opened[files_cache["processed"]:]:
+            if file not in files_cache["seen"]:
+                files_cache["seen"].add(file)
+                bisect.insort(files_cache["sorted"], file)
+        files_cache["processed"] = len(files_opened)
+        sorted_files = tuple(files_cache["sorted"])
+
+        # Cached on the (already sorted, deduped) file tuple, so the split
+        # work only reruns when a new file is actually opened
+        @st.cache_data(show_spinner=False)
+        def build_file_tree(files_tuple):
+            file_tree = defaultdict(list)
+            for file in files_tuple:
+                directory, _, filename = file.rpartition('/')
+                file_tree[directory or "root"].append(filename)
+            return dict(file_tree)
+
+        file_tree = build_file_tree(sorted_files)
+
         # Display the file tree
         for directory, files in file_tree.items():
             with st.expander(f"{directory} ({len(files)} files)"):
@@ -208,7 +430,11 @@ with st.sidebar:
     if "knowledge_base" in current_state and current_state["knowledge_base"]:
         st.success("Knowledge base has been generated!")
         with st.expander("View Knowledge Base"):
-            st.markdown(current_state["knowledge_base"])
+            # Gate the body behind a toggle so the (potentially large) KB
+            # markdown is only parsed and transmitted when actually viewed,
+            # not on every unrelated rerun
+            if st.toggle("Show knowledge base content", key="show_kb_content"):
+                st.markdown(current_state["knowledge_base"])
     elif current_state.get("generating_kb", False):
         progress = current_state.get('kb_exploration_rounds', 0)
         st.info(f"Knowledge base generation in progress... ({progress} rounds completed)")
@@ -216,25 +442,29 @@ with st.sidebar:
     else:
         st.info("No knowledge base generated yet. Type 'generate knowledge base' to start.")
     st.header("Tips")
-    st.success("""
-    - Start by asking about the overall structure
-    - Ask specific questions about functionality
-    - Inquire about specific files or components
-    """)
+    st.success(TIPS_TEXT)
 
 # Get user input
 if user_input := st.chat_input("Ask about the codebase..."):
 
-    # Check if this is the first message in the conversation
-    current_state = get_current_state()
-
-    is_first_message = len(current_state.get("messages", [])) == 0
+    # Check if this is the first message in the conversation. Once the
+    # conversation has started, a session flag answers this in O(1) instead
+    # of inspecting the deserialized message list every turn.
+    if st.session_state.get("has_messages"):
+        is_first_message = False
+    else:
+        is_first_message = len(get_current_state().get("messages", [])) == 0
+        # An already-started conversation can assert the flag right away; a
+        # first turn only earns it once its stream completes below, so a
+        # failed first turn retries with the system message intact
+        if not is_first_message:
+            st.session_state.has_messages = True
 
     # Prepare input state - add system message only for first interaction
     if is_first_message:
         input_state = {
             "messages": [
-                SystemMessage(content=initial_prompt),
+                get_system_message(),
                 HumanMessage(content=user_input)
             ]
         }
@@ -251,47 +481,98 @@ if user_input := st.chat_input("Ask about the codebase..."):
         message_placeholder = st.empty()
         
         async def stream_response():
-            full_response = ""
-            
+            # Accumulate deltas in a list and join only when flushing; string
+            # += would reallocate the whole response on every token.
+            chunks = []
+            last_flush = time.monotonic()
+            pending_chars = 0
+
+            # Re-render the placeholder at a bounded rate instead of on every
+            # token; markdown re-parsing of the growing string is otherwise
+            # quadratic in response length.
+            def flush(force=False):
+                nonlocal last_flush, pending_chars
+                if not chunks or not pending_chars:
+                    return
+                if not force and pending_chars < 64 and time.monotonic() - last_flush < STREAM_FLUSH_INTERVAL:
+                    return
+                message_placeholder.markdown("".join(chunks) + "▌")
+                last_flush = time.monotonic()
+                pending_chars = 0
+
+            # Decouple token reception from UI rendering: the producer drains
+            # the LangGraph stream at network speed into a bounded queue while
+            # the consumer flushes to the placeholder at display cadence, so a
+            # slow markdown render never backpressures the model stream.
+            queue = asyncio.Queue(maxsize=64)
+
+            async def produce():
+                try:
+                    async for msg, metadata in st.session_state.chatbot.app.astream(
+                        input_state,
+                        st.session_state.config,
+                        stream_mode="messages",
+                    ):
+                        # The summarizer's internal map-reduce calls stream
+                        # through the same channel; their tokens are history
+                        # compaction, not part of the reply, so drop them
+                        # before they reach the chat bubble
+                        if metadata.get("langgraph_node") == "summarizer":
+                            continue
+                        await queue.put(msg)
+                finally:
+                    await queue.put(None)
+
             try:
-                # Stream the response
-                async for msg, metadata in st.session_state.chatbot.app.astream(
-                    input_state,
-                    st.session_state.config,
-                    stream_mode="messages",
-                ):
+                producer = asyncio.ensure_future(produce())
+                # Consume the queued stream
+                while True:
+                    msg = await queue.get()
+                    if msg is None:
+                        break
                     # Handle tool messages differently
                     if isinstance(msg, ToolMessage):
                         # For tool messages, show they're being processed
                         display_msg = convert_message_for_display(msg)
-                        if full_response:
-                            full_response += "\n\n \n\n" + f"Using tool: {display_msg['preview']}..."
-                            message_placeholder.markdown(full_response + "▌")
-                    # Process regular message content
+                        if chunks:
+                            chunks.append("\n\n \n\n" + f"Using tool: {display_msg['preview']}...")
+                            pending_chars += 1
+                            flush(force=True)
+                    # Process regular message content: reduce each streamed
+                    # event to its text up front so the per-token loop stays
+                    # a buffer append; formatting happens at flush boundaries
                     elif hasattr(msg, 'content'):
-                        # Handle content that might be a list of chunks or a string
-                        if isinstance(msg.content, list):
-                            for chunk in msg.content:
-                                if isinstance(chunk, dict) and chunk.get('type') == 'text':
-                                    full_response += chunk['text']
-                        elif isinstance(msg.content, str):
-                            full_response += msg.content
-                        
+                        text = _text_of(msg.content)
+                        if text:
+                            chunks.append(text)
+                            pending_chars += len(text)
+
                         # Update the UI with current content
-                        if full_response:
-                            message_placeholder.markdown(full_response + "▌")
-                
-                # Force a rerun to update the conversation display
-                # This will read the latest state from the checkpoint
-                st.rerun()
-                
+                        flush()
+
+                # Surface any error raised inside the producer
+                await producer
+
+                # Finalize the placeholder in place (no cursor). The turn is
+                # already checkpointed, so the next natural rerun renders it
+                # from history; forcing st.rerun() here would re-execute the
+                # whole script just to redraw what is already on screen.
+                if chunks:
+                    message_placeholder.markdown("".join(chunks))
+                return True
+
             except Exception as e:
                 logger.error(f"Error during streaming: {e}")
                 message_placeholder.markdown(f"⚠️ Error: {str(e)}")
-                st.rerun()
+                return False
         
-        # Run the async function
-        loop = asyncio.new_event_loop()
-        task = loop.create_task(stream_response())
-        add_script_run_ctx(task)
-        loop.run_until_complete(task)
+        # Drive the stream on the session's background event loop (created at
+        # session init), keeping HTTP connection pools warm across turns.
+        # Re-attach the current script run's context so Streamlit calls made
+        # from the loop thread land in this session
+        add_script_run_ctx(st.session_state.loop_thread)
+        turn_ok = asyncio.run_coroutine_threadsafe(
+            stream_response(), st.session_state.event_loop
+        ).result()
+        if turn_ok:
+            st.session_state.has_messages = True
@@ -1,107 +1,453 @@
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
 from typing import Dict, Any
 import logging
 from langchain_aws import ChatBedrock
-from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 from .models import ChatState
 from .filesystem import FileSystem
 from .tools import create_tools
-from config import session, AWS_REGION, BEDROCK_MODEL
+from config import get_session, AWS_REGION, BEDROCK_MODEL, BOTO_CONFIG, BEDROCK_MAX_CONCURRENCY
 from langchain_core.messages import RemoveMessage
 
 logger = logging.getLogger(__name__)
 
-def route_tools(state: ChatState):
-    if not state["messages"]:
-        return END
-    last_message = state["messages"][-1]
-    if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-        return "tools"
-    return END
+# orjson serializes/parses the multi-KB snapshot records several times
+# faster than stdlib json; fall back transparently when it isn't installed
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+def _create_checkpointer(db_path: str):
+    """Build the graph checkpointer.
+
+    AsyncSqliteSaver needs a running event loop: its lock and aiosqlite
+    futures bind to the loop it lives on, while the shared graph is driven
+    from a different loop per Streamlit session (and get_state/update_state
+    from the script thread, which has none). The saver therefore gets its
+    own loop on a daemon thread and every call hops to it — the base class
+    already does this for sync calls from other threads, and the subclass
+    below extends the same treatment to async calls from foreign loops.
+    Falls back to the in-memory saver when the sqlite extras aren't
+    installed.
+    """
+    try:
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    except ImportError:
+        logger.info("aiosqlite not installed; using in-memory checkpoints")
+        return MemorySaver()
+
+    class _SharedAsyncSqliteSaver(AsyncSqliteSaver):
+        """AsyncSqliteSaver usable from any event loop.
+
+        Async methods invoked on a loop other than the saver's own are
+        re-scheduled onto the home loop via run_coroutine_threadsafe and
+        awaited without blocking the caller's loop.
+        """
+
+        async def _hop(self, coro):
+            if asyncio.get_running_loop() is self.loop:
+                return await coro
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(coro, self.loop)
+            )
+
+        async def aget_tuple(self, *args, **kwargs):
+            return await self._hop(AsyncSqliteSaver.aget_tuple(self, *args, **kwargs))
+
+        async def aput(self, *args, **kwargs):
+            return await self._hop(AsyncSqliteSaver.aput(self, *args, **kwargs))
+
+        async def aput_writes(self, *args, **kwargs):
+            return await self._hop(AsyncSqliteSaver.aput_writes(self, *args, **kwargs))
+
+        async def alist(self, *args, **kwargs):
+            if asyncio.get_running_loop() is self.loop:
+                async for item in AsyncSqliteSaver.alist(self, *args, **kwargs):
+                    yield item
+                return
+
+            async def collect():
+                return [item async for item in AsyncSqliteSaver.alist(self, *args, **kwargs)]
+
+            for item in await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(collect(), self.loop)
+            ):
+                yield item
+
+    try:
+        loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=loop.run_forever, daemon=True, name="checkpointer-loop"
+        ).start()
+
+        async def construct():
+            return _SharedAsyncSqliteSaver(aiosqlite.connect(db_path))
+
+        return asyncio.run_coroutine_threadsafe(construct(), loop).result()
+    except Exception as e:
+        logger.error(f"Failed to create sqlite checkpointer: {e}")
+    return MemorySaver()
+
+# One Bedrock client per process: client construction pays for credential
+# signing setup and a TLS connection pool, and nothing about it is
+# session-specific — per-session state lives in the graph, not the client
+@functools.lru_cache(maxsize=1)
+def _get_bedrock_llm() -> ChatBedrock:
+    # Latency-optimized inference (performance_config) is a Converse-API
+    # option that only ChatBedrockConverse exposes; ChatBedrock rejects the
+    # kwarg outright, so there is no way to opt in from this client without
+    # migrating it (which would also change the prompt-cache block format).
+    return ChatBedrock(
+        model_id=BEDROCK_MODEL,
+        region_name=get_session().region_name or AWS_REGION,
+        # max_tokens is an output cap, and 200000 exceeded what the model
+        # can emit; an honest ceiling avoids oversized server-side
+        # reservations and keeps queue latency down
+        model_kwargs={"temperature": 0.7, "max_tokens": 4096},
+        config=BOTO_CONFIG,
+    )
 
 class CodeExplorerChatbot:
     def __init__(self, codebase_path: str):
         self.fs = FileSystem(codebase_path)
-        self.kb_path = os.path.join(codebase_path, 'knowledge_base.md')  # New
-        self.checkpointer = MemorySaver()
-        self.llm = ChatBedrock(
-            model_id=BEDROCK_MODEL,
-            region_name=session.region_name or AWS_REGION,
-            model_kwargs={"temperature": 0.7, "max_tokens": 200000}
-        )
+        self.kb_path = os.path.join(codebase_path, 'knowledge_base.jsonl')  # New
+        self.legacy_kb_path = os.path.join(codebase_path, 'knowledge_base.md')
+        self._checkpoint_path = os.path.join(codebase_path, 'checkpoints.sqlite')
+        self._response_cache = OrderedDict()
+        self._tool_cache = OrderedDict()
+        self._kb_cache = None  # (mtime, replayed content) of kb_path
+        # Per-event-loop semaphores capping in-flight Bedrock calls; see
+        # _llm_semaphore for why one shared instance doesn't work
+        self._llm_sems = weakref.WeakKeyDictionary()
+
+    def _llm_semaphore(self) -> asyncio.Semaphore:
+        """Concurrency cap for Bedrock calls on the current event loop.
+
+        The chatbot is process-wide (st.cache_resource) while every
+        Streamlit session drives it from its own background loop; an
+        asyncio.Semaphore binds to the first loop that acquires it and
+        raises from any other, so the cap is tracked per loop. Weak keys
+        let entries die with their session's loop.
+        """
+        loop = asyncio.get_running_loop()
+        sem = self._llm_sems.get(loop)
+        if sem is None:
+            sem = self._llm_sems[loop] = asyncio.Semaphore(BEDROCK_MAX_CONCURRENCY)
+        return sem
 
-        self.tools, openai_tools = create_tools(self.fs)
-        self.llm_with_tools = self.llm.bind_tools(openai_tools)
-        self._initialize_workflow()
+    # Everything below is lazy: constructing the instance (e.g. just to call
+    # _load_knowledge_base) costs only a FileSystem scan; the Bedrock client,
+    # tool binding, checkpointer, and graph compile happen on first use of
+    # self.app and are cached for the instance's lifetime.
 
-    def _load_knowledge_base(self) -> str:        
+    @functools.cached_property
+    def checkpointer(self):
+        return _create_checkpointer(self._checkpoint_path)
+
+    @functools.cached_property
+    def llm(self) -> ChatBedrock:
+        return _get_bedrock_llm()
+
+    @functools.cached_property
+    def _toolkit(self):
+        return create_tools(self.fs)
+
+    @property
+    def tools(self):
+        return self._toolkit[0]
+
+    @functools.cached_property
+    def llm_with_tools(self):
+        return self.llm.bind_tools(self._toolkit[1])
+
+    # KB documents are the one place long output is expected; raise the
+    # output cap for that node only
+    @functools.cached_property
+    def kb_llm(self):
+        return self.llm_with_tools.bind(max_tokens=8192)
+
+    # Pre-bound dispatch table for the tools node: name -> awaitable,
+    # replacing the if/elif chain and per-call attribute lookups
+    @functools.cached_property
+    def _tool_dispatch(self):
+        return {
+            "open_files": lambda args: self.fs.aread_files(
+                args.get("file_paths", []), max_chars=30000
+            ),
+            "get_file_structure": lambda args: asyncio.to_thread(self.tools[0].func),
+        }
+
+    def _load_knowledge_base(self) -> str:
         try:
             if os.path.exists(self.kb_path):
+                # Serve from memory while the file is unchanged; KB stores
+                # grow to tens of KB and this is called per exploration round
+                mtime = os.path.getmtime(self.kb_path)
+                if self._kb_cache is not None and self._kb_cache[0] == mtime:
+                    return self._kb_cache[1]
+                # Append-only JSONL: replay snapshot/delta records in order
+                content = ""
                 with open(self.kb_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        record = _json_loads(line)
+                        if record.get("type") == "snapshot":
+                            content = record.get("content", "")
+                        elif record.get("type") == "delta":
+                            content += record.get("patch", "")
+                self._kb_cache = (mtime, content)
+                return content
+            if os.path.exists(self.legacy_kb_path):
+                with open(self.legacy_kb_path, 'r', encoding='utf-8') as f:
                     return f.read()
         except Exception as e:
             logger.error(f"Error loading knowledge base: {e}")
         return ""
 
+    def _append_kb_record(self, kb_content: str) -> None:
+        with open(self.kb_path, 'a', encoding='utf-8') as f:
+            f.write(_json_dumps({"type": "snapshot", "content": kb_content}) + "\n")
+        self._kb_cache = None
+
+    # Compiled once; IGNORECASE means no lowercased copy of the (possibly
+    # large) message content is allocated per turn
+    _GENERATE_KB_RE = re.compile(r"\bgenerate\s+(?:kb|knowledge\s+base)\b", re.IGNORECASE)
+
+    # The command is typed as a short instruction, so only the start of the
+    # message is scanned — pasting a large code blob never pays a full scan
+    _GENERATE_KB_SCAN_CHARS = 256
+
+    KB_INSTRUCTION = """
+In order for you to quickly anwser my questions, you should start ramp up and build a high-level understanding knowledge base of the codebase through iterative file analysis, summarization, and strategic file selection.
+The goal is to capture the critical code path, core business logic and workflow. This knowledge base will be a key reference when anwsering my questions.
+if there is a existing knowledge base, review it first, then explore to enhance the knowledge base.
+If Files Examined provided in existing knowledge base, you should prioritize files not examined for new information and focus more on detailed business logic.
+
+In each round:
+1. Request to open up to 5 files each time, ONLY open files that are exist in the file structure output
+2. For opened files, summarize what findings you find valuable for the high-level knowledge base, note down key findings, criticle methods, also main business logic[important].
+3. Propose next files to explore based on new findings, explain the reason and use tools to open it.\n\n
+        """
+
     # Node implementations as class methods
     def _preprocessor_node(self, state: ChatState) -> ChatState:
         if not state["messages"]:
             return state
         last_message = state["messages"][-1]
         if isinstance(last_message, HumanMessage) and isinstance(last_message.content, str):
-            content = last_message.content.lower().strip()
-            if "generate kb" in content or "generate knowledge base" in content:
-                return {**state, "command": "generate_kb"}
-        return {**state, "command": None}
+            if self._GENERATE_KB_RE.search(last_message.content[:self._GENERATE_KB_SCAN_CHARS]):
+                # Kick off KB exploration right here; a dedicated node for
+                # this only added an extra checkpointer write per kickoff
+                return {
+                    "messages": [HumanMessage(content=self.KB_INSTRUCTION)],
+                    "generating_kb": True,
+                    "kb_exploration_rounds": 0,
+                    "command": None,
+                }
+        return {"command": None}
+
+    # Messages this recent keep their full tool output in the LLM context;
+    # older tool bodies are trimmed to a snippet before sending
+    TOOL_CONTEXT_KEEP = 2
+    TOOL_SNIPPET_CHARS = 300
+
+    # Max distinct contexts kept in the LLM response cache (LRU)
+    RESPONSE_CACHE_SIZE = 128
+
+    # Max distinct open_files argument sets kept in the tool-result LRU
+    TOOL_CACHE_SIZE = 64
+
+    def _trim_context(self, messages):
+        """Shrink old tool outputs before sending the history to the model.
+
+        The model has already summarized earlier file contents in its own
+        replies, so re-sending the raw multi-KB blobs every turn only adds
+        tokens and latency. The checkpointed state is left untouched.
+        """
+        context = list(messages)
+        for i, msg in enumerate(context[:-self.TOOL_CONTEXT_KEEP]):
+            if (isinstance(msg, ToolMessage) and isinstance(msg.content, str)
+                    and len(msg.content) > self.TOOL_SNIPPET_CHARS):
+                context[i] = msg.model_copy(
+                    update={"content": msg.content[:self.TOOL_SNIPPET_CHARS] + "\n...[trimmed]"}
+                )
+        return context
+
+    def _context_key(self, context) -> str:
+        """Stable fingerprint of the exact context sent to the model.
+
+        tool_calls are part of the fingerprint: two contexts whose AI turns
+        differ only in tool-call arguments must not collide.
+        """
+        digest = hashlib.sha256()
+        for msg in context:
+            digest.update(type(msg).__name__.encode())
+            digest.update(str(msg.content).encode())
+            tool_calls = getattr(msg, "tool_calls", None)
+            if tool_calls:
+                digest.update(str(tool_calls).encode())
+        return digest.hexdigest()
+
+    # Cap on inline "Continue" nudges per agent-node visit during KB
+    # exploration; replaces the graph recursion limit the self-edge had
+    KB_CONTINUE_MAX_NUDGES = 3
+
+    async def _call_model(self, context, config):
+        """Cached, streamed model call for the agent node.
+
+        Repeating a question against unchanged state skips the Bedrock
+        round trip entirely; cached entries are replayed as fresh
+        AIMessages so message ids stay unique in the checkpoint. On a
+        miss, chunks are accumulated from astream so tokens surface to
+        the UI's message stream at first-token time.
+        """
+        cache_key = self._context_key(context)
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            self._response_cache.move_to_end(cache_key)
+            return AIMessage(content=cached)
+
+        response = None
+        async with self._llm_semaphore():
+            async for chunk in self.llm_with_tools.astream(context, config):
+                response = chunk if response is None else response + chunk
+        # Tool-calling responses are never cached: a replay would re-emit
+        # the original tool_use ids into the thread (duplicate ids) and
+        # re-execute a stale tool plan
+        if not response.tool_calls:
+            self._response_cache[cache_key] = response.content
+            if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+        return response
 
     async def _agent_node(self, state: ChatState, config) -> ChatState:
         last_message = state["messages"][-1]
         generating_kb = state.get("generating_kb", False)
-        # if isinstance(last_message, ToolMessage) and hasattr(last_message, 'metadata') and last_message.metadata["tool_name"] == "open_files":
-        #     response = await self.llm_with_tools.ainvoke(state["messages"] + [HumanMessage(content="\n\n [Remind: Create summaries for opening files, if you have created summary above, ignore this reminder]")], config)
 
-        response = await self.llm_with_tools.ainvoke(state["messages"], config)
+        context = self._trim_context(state["messages"])
+        # Surface the rolling summary of compacted turns; without it the
+        # model loses everything the summarizer removed from the window.
+        # The summarizer keeps the session's SystemMessage at position 0,
+        # and the Bedrock formatter rejects a system message anywhere else,
+        # so the summary is merged into that message rather than prepended
+        # as a second one.
+        summary = state.get("summary") or ""
+        if summary:
+            summary_text = f"Summary of the earlier conversation:\n{summary}"
+            if context and isinstance(context[0], SystemMessage):
+                first = context[0]
+                if isinstance(first.content, str):
+                    context[0] = first.model_copy(
+                        update={"content": first.content + "\n\n" + summary_text}
+                    )
+                else:
+                    context[0] = first.model_copy(
+                        update={"content": list(first.content) + [{"type": "text", "text": summary_text}]}
+                    )
+            else:
+                context = [SystemMessage(content=summary_text)] + context
 
-        # remove message content
+        # Drop the raw file contents the model has now seen: returning a
+        # message with the same id replaces it through the add_messages
+        # reducer, so this rides the node's own checkpoint commit instead of
+        # forcing a second update_state write mid-node
+        updates = []
         if isinstance(last_message, ToolMessage) and hasattr(last_message, 'metadata') and last_message.metadata["tool_name"] == "open_files":
-            last_message.content = "..."
-            self.app.update_state({"configurable": {"thread_id": "1"}}, {"messages": last_message})
+            updates.append(last_message.model_copy(update={"content": "..."}))
+
+        response = await self._call_model(context, config)
+        new_messages = [response]
 
-        if not response.tool_calls and generating_kb:
-            return {"messages": [response, HumanMessage(content="\n\n Continue")]}
-        return {"messages": [response]}
+        # KB exploration used to bounce agent -> router -> agent just to
+        # append a "Continue" nudge; doing the continuation inline saves a
+        # graph traversal and checkpoint write per iteration
+        nudges = 0
+        while generating_kb and not response.tool_calls and nudges < self.KB_CONTINUE_MAX_NUDGES:
+            nudge = HumanMessage(content="\n\n Continue")
+            context = context + [response, nudge]
+            response = await self._call_model(context, config)
+            new_messages += [nudge, response]
+            nudges += 1
 
-    def _execute_tools_node(self, state: ChatState) -> ChatState:
-        messages = []
+        result = {"messages": updates + new_messages}
+        if generating_kb and not response.tool_calls:
+            # The nudge budget ran out without another tool call, so no
+            # route to generate_kb remains this run; clear the flag or the
+            # UI reports generation-in-progress forever and every later
+            # turn pays the nudge loop again
+            result["generating_kb"] = False
+        return result
+
+    async def _execute_tools_node(self, state: ChatState) -> ChatState:
         last_message = state["messages"][-1]
-        all_files_opened = []
         generating_kb = state.get("generating_kb", False)
         kb_exploration_rounds = state.get("kb_exploration_rounds", 0)
-        used_open_files = False
-        
-        for tool_call in last_message.tool_calls:
+
+        # Tool calls within one LLM turn are independent, so dispatch them
+        # all concurrently; gather preserves the original call order.
+        async def dispatch(tool_call):
             tool_name = tool_call["name"]
-            tool_id = tool_call["id"]
-            if tool_name == "open_files":
-                file_paths = tool_call["args"].get("file_paths", [])
-                result = self.tools[1].func(file_paths)
-                all_files_opened.extend(file_paths)
-                used_open_files = True
-                tool_metadata = {"tool_name": tool_name, "files": file_paths}
-            elif tool_name == "get_file_structure":
-                result = self.tools[0].func()
+            file_paths = []
+            handler = self._tool_dispatch.get(tool_name)
+            if handler is None:
+                result = f"Unknown tool: {tool_name}"
                 tool_metadata = {"tool_name": tool_name}
             else:
-                result = f"Unknown tool: {tool_name}"
                 tool_metadata = {"tool_name": tool_name}
-            messages.append(ToolMessage(
-                content=result, 
-                tool_call_id=tool_id,
+                cache_key = None
+                if tool_name == "open_files":
+                    file_paths = tool_call["args"].get("file_paths", [])
+                    tool_metadata["files"] = file_paths
+                    # KB exploration re-opens overlapping file sets across
+                    # rounds; identical requests are served from the cache
+                    cache_key = (tool_name, tuple(sorted(file_paths)))
+                if cache_key is not None and cache_key in self._tool_cache:
+                    self._tool_cache.move_to_end(cache_key)
+                    result = self._tool_cache[cache_key]
+                else:
+                    result = await handler(tool_call["args"])
+                    if cache_key is not None:
+                        self._tool_cache[cache_key] = result
+                        if len(self._tool_cache) > self.TOOL_CACHE_SIZE:
+                            self._tool_cache.popitem(last=False)
+            message = ToolMessage(
+                content=result,
+                tool_call_id=tool_call["id"],
                 metadata=tool_metadata
-            ))
-        
+            )
+            return message, file_paths
+
+        results = await asyncio.gather(
+            *(dispatch(tool_call) for tool_call in last_message.tool_calls)
+        )
+        messages = [message for message, _ in results]
+        # Dedupe (order-preserving) before the reducer appends to state, so
+        # the checkpoint doesn't accumulate duplicate path strings
+        all_files_opened = list(dict.fromkeys(
+            fp for _, file_paths in results for fp in file_paths
+        ))
+        used_open_files = bool(all_files_opened)
+
         if generating_kb and used_open_files:
             kb_exploration_rounds += 1
         
@@ -113,35 +459,15 @@ class CodeExplorerChatbot:
             "command": None
         }
 
-    def _start_kb_exploration_node(self, state: ChatState) -> ChatState:
-        kb_instruction = """
-In order for you to quickly anwser my questions, you should start ramp up and build a high-level understanding knowledge base of the codebase through iterative file analysis, summarization, and strategic file selection.
-The goal is to capture the critical code path, core business logic and workflow. This knowledge base will be a key reference when anwsering my questions.
-if there is a existing knowledge base, review it first, then explore to enhance the knowledge base.
-If Files Examined provided in existing knowledge base, you should prioritize files not examined for new information and focus more on detailed business logic.
-
-In each round:
-1. Request to open up to 5 files each time, ONLY open files that are exist in the file structure output
-2. For opened files, summarize what findings you find valuable for the high-level knowledge base, note down key findings, criticle methods, also main business logic[important].
-3. Propose next files to explore based on new findings, explain the reason and use tools to open it.\n\n
-        """
-        return {
-            "messages": [HumanMessage(content=kb_instruction)],
-            "generating_kb": True,
-            "kb_exploration_rounds": 0,
-            "command": None
-        }
-
-    async def _generate_knowledge_base_node(self, state: ChatState, config) -> ChatState:
-        existing_kb = state.get("knowledge_base", "")
-        kb_prompt = HumanMessage(content=f"""
+    # Static KB-generation protocol, hoisted so it is built once and forms a
+    # byte-stable prompt prefix (the variable existing-KB text is appended as
+    # a suffix, which keeps provider-side prompt caching effective)
+    KB_PROMPT_STATIC = """
 # Knowledge Base Update Protocol
 
 ## OBJECTIVE
 Generate a structured technical document in Markdown that captures the complete understanding of the codebase based on all explorations so far.
 Use mermaid if you want to generate graph.
-                                 
-- Previously established knowledge: {existing_kb}
 
 ## DOCUMENT STRUCTURE
 Use following sections as mental model reference.
@@ -158,7 +484,7 @@ Communication Flow: How information moves through system
 - **Data Flow**: How information moves through the system
 ### 3. Control Flow Understanding
 Entry Points: Where execution begins
-Request Lifecycle: Request → processing → response path
+Request Lifecycle: Request \u2192 processing \u2192 response path
 Event Handling: How system responds to triggers
 ### 4: Core Business Logic
 This is important, can be more detailed
@@ -174,16 +500,52 @@ Key Dependencies: Critical external libraries
 - **Unexplored Areas**: Components or aspects not yet fully understood, uncertainties that remain after exploration
 
 ## OUTPUT FORMAT
-Generate the COMPLETE knowledge base document incorporating both existing and new knowledge. 
+Generate the COMPLETE knowledge base document incorporating both existing and new knowledge.
 Do additions to the existing knowledge base, don't do deletions unless you have good reason.
 Do not merely describe changes or additions - provide the entire updated knowledge base as a cohesive markdown document.
-        """)
-        
-        kb_response = await self.llm_with_tools.ainvoke(
-            state["messages"] + [kb_prompt],
-            config
+"""
+
+    async def _generate_knowledge_base_node(self, state: ChatState, config) -> ChatState:
+        existing_kb = state.get("knowledge_base", "")
+        # The static protocol rides in a system block carrying a
+        # cache_control marker: Bedrock caches the prefill KV state for the
+        # marked prefix, so repeated KB rounds skip re-processing the
+        # template. Only the small dynamic suffix (existing KB) varies.
+        # The thread's own SystemMessage sits at messages[0] and the Bedrock
+        # formatter allows system content only at index 0, so it is folded
+        # into the same message ahead of the cached block.
+        history = list(state["messages"])
+        system_blocks = []
+        if history and isinstance(history[0], SystemMessage):
+            first = history.pop(0)
+            if isinstance(first.content, str):
+                system_blocks.append({"type": "text", "text": first.content})
+            else:
+                system_blocks.extend(
+                    {"type": "text", "text": block} if isinstance(block, str) else block
+                    for block in first.content
+                )
+        system_blocks.append({
+            "type": "text",
+            "text": self.KB_PROMPT_STATIC,
+            "cache_control": {"type": "ephemeral"},
+        })
+        kb_system = SystemMessage(content=system_blocks)
+        kb_prompt = HumanMessage(
+            content=f"- Previously established knowledge: {existing_kb}\n"
         )
 
+        # Stream the generation instead of awaiting the full response: the
+        # UI's message stream shows progress token by token, and first output
+        # arrives without waiting for the entire multi-KB document
+        kb_response = None
+        async with self._llm_semaphore():
+            async for chunk in self.kb_llm.astream(
+                [kb_system] + history + [kb_prompt],
+                config
+            ):
+                kb_response = chunk if kb_response is None else kb_response + chunk
+
         # Process content to ensure it's always a string
         if isinstance(kb_response.content, list):
             kb_content = "".join(
@@ -194,11 +556,12 @@ Do not merely describe changes or additions - provide the entire updated knowled
             kb_content = str(kb_response.content)
 
 
-        # Persist updated KB  # New
+        # Persist updated KB as an appended snapshot record; append-only
+        # writes avoid rewriting (and briefly truncating) the whole store.  # New
+        # The write runs in a thread so the event loop isn't blocked on disk.
         try:
-            with open(self.kb_path, 'w', encoding='utf-8') as f:
-                f.write(kb_content)
-            logger.info(f"Updated knowledge base persisted to {self.kb_path}")
+            await asyncio.to_thread(self._append_kb_record, kb_content)
+            logger.info(f"Updated knowledge base appended to {self.kb_path}")
         except Exception as e:
             logger.error(f"Failed to save knowledge base: {e}")
 
@@ -210,26 +573,71 @@ Do not merely describe changes or additions - provide the entire updated knowled
             "command": None
         }
 
+    # Messages kept verbatim when the rolling summarizer compacts history
+    SUMMARY_KEEP_MESSAGES = 4
+    # Map-reduce bounds: messages per map chunk, chars of rendered text per
+    # prompt — keeps summarizer prefill O(chunk), not O(history)
+    SUMMARY_CHUNK_SIZE = 5
+    SUMMARY_CHUNK_CHARS = 4000
+
+    @staticmethod
+    def _render_for_summary(messages) -> str:
+        """Compact plain-text rendering of messages for summary prompts.
+
+        The old f-string interpolation repr'd every Message object —
+        metadata, ids, and multi-KB tool bodies included — into the prompt.
+        """
+        return "\n".join(
+            f"{type(m).__name__}: {m.content}"
+            for m in messages
+            if isinstance(m.content, str) and m.content
+        )
+
     async def _summarize_conversation(self, state: ChatState, config) -> ChatState:
-        # Keep last 4 messages (adjust number as needed)
-        keep_messages = 1
+        keep_messages = self.SUMMARY_KEEP_MESSAGES
         messages_to_remove = state["messages"][:-keep_messages]
 
         if isinstance(messages_to_remove[0], SystemMessage):
             messages_to_remove.pop(0)
-        
-        # Generate summary including existing summary
+
+        # Map: summarize fixed-size chunks concurrently, then reduce into the
+        # rolling summary. One chunk skips the map stage entirely.
+        chunks = [
+            messages_to_remove[i:i + self.SUMMARY_CHUNK_SIZE]
+            for i in range(0, len(messages_to_remove), self.SUMMARY_CHUNK_SIZE)
+        ]
+
+        async def summarize_chunk(chunk):
+            prompt = (
+                "Summarize the key technical details of these conversation "
+                "messages in less than 200 words:\n"
+                + self._render_for_summary(chunk)[:self.SUMMARY_CHUNK_CHARS]
+            )
+            async with self._llm_semaphore():
+                response = await self.llm_with_tools.ainvoke(
+                    [HumanMessage(content=prompt)], config
+                )
+            return str(response.content)
+
+        if len(chunks) > 1:
+            new_material = "\n\n".join(
+                await asyncio.gather(*(summarize_chunk(c) for c in chunks))
+            )
+        else:
+            new_material = self._render_for_summary(messages_to_remove)[:self.SUMMARY_CHUNK_CHARS]
+
         summary_prompt = f"""
         Current conversation summary: {state.get('summary', '')}
         Update this summary with key technical details from these new messages:
-        {messages_to_remove}
+        {new_material}
         less than 500 words
         """
-        
-        response = await self.llm_with_tools.ainvoke(
-            [HumanMessage(content=summary_prompt)],
-            config
-        )
+
+        async with self._llm_semaphore():
+            response = await self.llm_with_tools.ainvoke(
+                [HumanMessage(content=summary_prompt)],
+                config
+            )
         
         # Create RemoveMessage for old messages
         delete_messages = [RemoveMessage(id=m.id) for m in messages_to_remove]
@@ -239,25 +647,14 @@ Do not merely describe changes or additions - provide the entire updated knowled
             "messages": delete_messages  # This will remove old messages from state
         }
 
-    def _route_after_preprocessing(self, state: ChatState):
-        command = state.get("command")
-        if command == "generate_kb":
-            return "start_kb_exploration"
-        return "agent"
-    
     def _route_tools_node(self, state: ChatState):
-        generating_kb = state.get("generating_kb", False)
-
         if not state["messages"]:
             return END
-        
+
         last_message = state["messages"][-1]
         if hasattr(last_message, "tool_calls") and last_message.tool_calls:
             return "tools"
 
-        if generating_kb:
-            return "agent"
-        
         if len(state["messages"]) > 15:
             return "summarizer"
         
@@ -268,30 +665,24 @@ Do not merely describe changes or additions - provide the entire updated knowled
             return "generate_kb"
         return 'agent'
     
-    def _initialize_workflow(self):
+    @functools.cached_property
+    def app(self):
         workflow = StateGraph(ChatState)
         
         # Add nodes
         workflow.add_node("preprocessor", self._preprocessor_node)
         workflow.add_node("agent", self._agent_node)
         workflow.add_node("tools", self._execute_tools_node)
-        workflow.add_node("start_kb_exploration", self._start_kb_exploration_node)
         workflow.add_node("generate_kb", self._generate_knowledge_base_node)
         workflow.add_node("summarizer", self._summarize_conversation)
         
         # Set entry point
         workflow.set_entry_point("preprocessor")
         
-        # Connect preprocessor router
-        workflow.add_conditional_edges(
-            "preprocessor",
-            self._route_after_preprocessing,
-            {
-                "agent": "agent",
-                "start_kb_exploration": "start_kb_exploration"
-            }
-        )
-        
+        # The preprocessor emits KB-exploration state itself when the
+        # command is detected, so it always flows straight into the agent
+        workflow.add_edge("preprocessor", "agent")
+
         # Connect agent router
         workflow.add_conditional_edges(
             "agent",
@@ -299,7 +690,6 @@ Do not merely describe changes or additions - provide the entire updated knowled
             {
                 "tools": "tools",
                 "summarizer": "summarizer",
-                "agent": "agent",
                 END: END
             }
         )
@@ -309,8 +699,7 @@ Do not merely describe changes or additions - provide the entire updated knowled
             "agent": "agent",
             "generate_kb": "generate_kb"
         })
-        workflow.add_edge("start_kb_exploration", "agent")
         workflow.add_edge("generate_kb", END)
         workflow.add_edge("summarizer", END)
         
-        self.app = workflow.compile(checkpointer=self.checkpointer)
\ No newline at end of file
+        return workflow.compile(checkpointer=self.checkpointer)
\ No newline at end of file
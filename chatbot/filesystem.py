@@ -1,81 +1,283 @@
+import asyncio
+import functools
+import itertools
+import json
+import operator
 import os
 import logging
+import stat
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import List
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Lowercase extensions (without the dot) of files treated as source text;
+# frozen at module scope so the scan filter is a plain membership test
+TEXT_EXTENSIONS = frozenset({'java', 'py', 'js', 'cpp', 'h', 'yml', 'yaml', 'properties'})
+
+# Deletes digits in one C pass instead of a per-character generator
+_DIGIT_DELETE_TABLE = str.maketrans('', '', '0123456789')
+
 class FileSystem:
     def __init__(self, codebase_path: str):
         self.path = Path(codebase_path)
-        self.files = self._list_files()
+        self._path_str = str(self.path)
+        self._structure_cache = None
+        self._structure_mtime = 0.0
+        # LRU of read file contents keyed on path; entries carry the
+        # (mtime_ns, size) they were read at so edits invalidate naturally
+        self._content_cache = OrderedDict()
+        self._content_cache_lock = threading.Lock()
+        # Pre-warm the listing in the background: the walk overlaps whatever
+        # startup work follows instead of blocking the constructor, while
+        # first access still works if the thread hasn't finished
+        threading.Thread(target=lambda: self.files, daemon=True).start()
+
+    @functools.cached_property
+    def _file_sizes(self):
+        return dict(self._list_files())
+
+    @functools.cached_property
+    def files(self) -> List[str]:
+        return list(self._file_sizes)
+
+    @functools.cached_property
+    def _non_test_files(self) -> List[str]:
+        """Files whose stem doesn't end in 'test' (case insensitive).
+
+        Pure string ops — the old filter built a Path per file just to
+        read its stem — and computed once per listing.
+        """
+        non_test = []
+        for file in self.files:
+            name = file.rpartition(os.sep)[2]
+            stem = name.rpartition('.')[0] or name
+            if not stem.lower().endswith('test'):
+                non_test.append(file)
+        return non_test
+
+    def _list_files(self):
+        """List all text files in the codebase as (relative path, size) pairs.
+
+        Walks with os.scandir instead of rglob: DirEntry type checks come
+        from the directory read itself, so the walk costs one syscall per
+        directory rather than an extra stat per entry. Directories are
+        scanned on a thread pool — scandir releases the GIL, so overlapping
+        the per-directory reads hides I/O latency on large trees.
+        """
+        root = self._path_str
+        prefix_len = len(root) + 1
 
-    def _list_files(self) -> List[str]:
-        """List all text files in the codebase."""
-        text_extensions = {'.java', '.py', '.js', '.cpp', '.h', '.yml', '.yaml', '.properties'}
-        return [str(f.relative_to(self.path)) for f in self.path.rglob("*") 
-                if f.is_file() and f.suffix.lower() in text_extensions]
+        def scan_dir(directory):
+            found, subdirs = [], []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            _, dot, ext = entry.name.rpartition('.')
+                            # Extensions are almost always already lowercase;
+                            # the first test skips the .lower() allocation
+                            if dot and (ext in TEXT_EXTENSIONS or ext.lower() in TEXT_EXTENSIONS):
+                                # Size comes from the same DirEntry, so the
+                                # structure view never has to stat again
+                                size = entry.stat(follow_symlinks=False).st_size
+                                found.append((entry.path[prefix_len:], size))
+            except OSError as e:
+                logger.warning(f"Skipping unreadable directory {directory}: {e}")
+            return found, subdirs
+
+        files = []
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 4) * 4)) as executor:
+            pending = {executor.submit(scan_dir, root)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found, subdirs = future.result()
+                    files.extend(found)
+                    pending.update(executor.submit(scan_dir, d) for d in subdirs)
+        return files
 
     def get_file_structure(self) -> str:
-        """Generate a nested file structure with total size, ignoring test files."""
-        # Filter out test files (case insensitive)
-        non_test_files = [file for file in self.files if not Path(file).stem.lower().endswith('test')]
-        
-        # Calculate total size of non-test files
-        total_size = sum((self.path / file).stat().st_size for file in non_test_files) / 1024
-        structure = f"{self.path.name} ({total_size:.1f}KB, {len(non_test_files)} files)\n"
-        
-        packages = {}
-        for file in non_test_files:
-            parts = file.split(os.sep)
-            pkg = "/".join(parts[:-1]) if len(parts) > 1 else ""
-            if pkg not in packages:
-                packages[pkg] = []
-            packages[pkg].append(parts[-1])
-        
-        for pkg, files in sorted(packages.items()):
+        """Generate a nested file structure with total size, ignoring test files.
+
+        The rendered structure is cached and invalidated on the codebase
+        root's mtime, so repeated tool calls within a session skip the
+        stat-per-file walk.
+        """
+        root_mtime = self.path.stat().st_mtime
+        if self._structure_cache is not None and self._structure_mtime == root_mtime:
+            return self._structure_cache
+
+        non_test_files = self._non_test_files
+
+        # Calculate total size of non-test files from sizes harvested
+        # during the scan — no syscalls on this path
+        total_size = sum(self._file_sizes[file] for file in non_test_files) / 1024
+        # Build through a list and join once: += in the per-file loop
+        # reallocates the whole string each iteration
+        lines = [f"{self.path.name} ({total_size:.1f}KB, {len(non_test_files)} files)\n"]
+
+        # One sort of (package, filename) pairs plus groupby replaces the
+        # dict-of-lists and its per-package sorts; rpartition splits each
+        # path exactly once and groups arrive already ordered. Interning the
+        # package prefix collapses the hundreds of per-file copies of deep
+        # directory strings into one object each, making the sort and
+        # groupby comparisons identity-fast
+        split_files = sorted(
+            (sys.intern(pkg), name)
+            for pkg, _, name in (f.rpartition(os.sep) for f in non_test_files)
+        )
+
+        for pkg, group in itertools.groupby(split_files, key=operator.itemgetter(0)):
+            names = [name for _, name in group]
             if pkg:
-                structure += f"├── {pkg} ({len(files)} files)\n"
-            for file in sorted(files):
-                structure += f"│   ├── {file}\n" if pkg else f"├── {file}\n"
-        
-        return structure.strip()
+                lines.append(f"├── {pkg.replace(os.sep, '/')} ({len(names)} files)\n")
+            for name in names:
+                lines.append(f"│   ├── {name}\n" if pkg else f"├── {name}\n")
 
+        self._structure_cache = "".join(lines).strip()
+        self._structure_mtime = root_mtime
+        return self._structure_cache
 
-    def read_files(self, file_paths: List[str], max_chars: int = 30000) -> str:
-        """Read content of selected files, trimmed to max_chars, with path cleaning."""
-        contents = {}
-        cleaned_paths = []
+
+    def invalidate(self):
+        """Drop the cached listing, structure, and file contents; the next
+        access recomputes from disk. The root mtime stamp usually catches
+        changes on its own, but edits inside nested directories don't touch
+        the root, so callers that mutate the tree can force a refresh here.
+        """
+        # cached_property stores its result in the instance dict; popping
+        # re-triggers the walk (and derived lists) on next access
+        for cached in ("_file_sizes", "files", "_non_test_files"):
+            self.__dict__.pop(cached, None)
+        self._structure_cache = None
+        self._structure_mtime = 0.0
+        with self._content_cache_lock:
+            self._content_cache.clear()
+
+    def _clean_paths(self, file_paths) -> List[str]:
+        """Normalize LLM-provided file paths into a list of clean relative paths."""
+        raw_paths = []
 
         if isinstance(file_paths, str):
             fp_cleaned = file_paths.replace('\n', '').strip()
             if fp_cleaned.startswith('[') and fp_cleaned.endswith(']'):
                 try:
-                    import ast
-                    cleaned_paths = ast.literal_eval(fp_cleaned)
-                    logger.debug("Converted stringified files list: %s", cleaned_paths)
-                except (ValueError, SyntaxError) as e:
-                    logger.error("Failed to parse stringified file list: %s", str(e))
-                    return "No valid file contents retrieved."
+                    # LLM tool calls emit double-quoted JSON lists; the C
+                    # json parser handles those without invoking the Python
+                    # compiler the way ast.literal_eval does
+                    raw_paths = json.loads(fp_cleaned)
+                except json.JSONDecodeError:
+                    try:
+                        import ast
+                        raw_paths = ast.literal_eval(fp_cleaned)
+                    except (ValueError, SyntaxError) as e:
+                        logger.error("Failed to parse stringified file list: %s", str(e))
+                        return []
+                logger.debug("Converted stringified files list: %s", raw_paths)
             else:
-                cleaned_paths = [fp_cleaned]
+                raw_paths = [fp_cleaned]
         elif isinstance(file_paths, list):
-            cleaned_paths = file_paths
+            raw_paths = file_paths
 
-        for fp in cleaned_paths:
+        cleaned_paths = []
+        for fp in raw_paths:
             fp_clean = fp.strip().strip("'\"[]").strip()
-            fp_clean = ''.join(c for c in fp_clean if not c.isdigit()).strip().lstrip('. ').strip()
+            fp_clean = fp_clean.translate(_DIGIT_DELETE_TABLE).strip().lstrip('. ').strip()
             if not fp_clean or fp_clean == '/':
                 logger.warning(f"Skipping invalid file path: {fp}")
                 continue
-            full_path = self.path / fp_clean
-            if full_path.exists() and full_path.is_file():
-                try:
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                        contents[fp_clean] = content[:max_chars] + ("..." if len(content) > max_chars else "")
-                except Exception as e:
-                    logger.error(f"Error reading file {fp_clean}: {str(e)}")
-            else:
-                logger.warning(f"File not found or not a file: {fp_clean}")
-        return "\n\n".join([f"{fp}:\n{cont}" for fp, cont in contents.items()]) if contents else "No valid file contents retrieved."
+            cleaned_paths.append(fp_clean)
+        return cleaned_paths
+
+    # Bound on cached file contents; ~2MB at the 30000-char trim cap
+    CONTENT_CACHE_SIZE = 64
+
+    def _read_one(self, fp_clean: str, max_chars: int):
+        """Read a single cleaned path; returns (path, trimmed content) or None.
+
+        Agent loops re-request the same files across turns, so trimmed
+        contents are kept in an LRU validated against the file's current
+        (mtime_ns, size) — unchanged files are served without reopening.
+        """
+        # os.stat/open only need a string; skipping the per-file Path
+        # construction keeps the hot read path allocation-free
+        full_path = os.path.join(self._path_str, fp_clean)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            logger.warning(f"File not found or not a file: {fp_clean}")
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            logger.warning(f"File not found or not a file: {fp_clean}")
+            return None
+        if st.st_size == 0:
+            return fp_clean, ""
+
+        key = (fp_clean, max_chars)
+        with self._content_cache_lock:
+            cached = self._content_cache.get(key)
+            if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                self._content_cache.move_to_end(key)
+                return fp_clean, cached[2]
+
+        try:
+            # Bounded read: only max_chars+1 characters are ever decoded, so
+            # a multi-MB generated file costs the same as a small one
+            with open(full_path, "r", encoding="utf-8", errors="replace") as f:
+                head = f.read(max_chars + 1)
+            trimmed = head[:max_chars] + ("..." if len(head) > max_chars else "")
+        except Exception as e:
+            logger.error(f"Error reading file {fp_clean}: {str(e)}")
+            return None
+
+        with self._content_cache_lock:
+            self._content_cache[key] = (st.st_mtime_ns, st.st_size, trimmed)
+            if len(self._content_cache) > self.CONTENT_CACHE_SIZE:
+                self._content_cache.popitem(last=False)
+        return fp_clean, trimmed
+
+    @staticmethod
+    def _format_contents(results) -> str:
+        # Flat fragment list joined once: no per-file f-string copies of the
+        # (up to 30KB) contents, so peak memory stays ~1x the output size
+        parts = []
+        for result in results:
+            if result:
+                fp, cont = result
+                if parts:
+                    parts.append("\n\n")
+                parts += (fp, ":\n", cont)
+        return "".join(parts) if parts else "No valid file contents retrieved."
+
+    def read_files(self, file_paths: List[str], max_chars: int = 30000) -> str:
+        """Read content of selected files, trimmed to max_chars, with path cleaning.
+
+        Multi-file batches fan out over a thread pool: reads are independent
+        and the GIL is released during the I/O, so wall time approaches the
+        slowest single read instead of the sum.
+        """
+        cleaned_paths = self._clean_paths(file_paths)
+        if len(cleaned_paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(8, len(cleaned_paths))) as executor:
+                results = list(executor.map(
+                    lambda fp: self._read_one(fp, max_chars), cleaned_paths
+                ))
+        else:
+            results = [self._read_one(fp, max_chars) for fp in cleaned_paths]
+        return self._format_contents(results)
+
+    async def aread_files(self, file_paths: List[str], max_chars: int = 30000) -> str:
+        """Async variant of read_files: reads are independent blocking I/O,
+        so they fan out to threads and complete in max (not sum) of latencies."""
+        cleaned_paths = self._clean_paths(file_paths)
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._read_one, fp, max_chars) for fp in cleaned_paths)
+        )
+        return self._format_contents(results)
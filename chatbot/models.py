@@ -1,4 +1,3 @@
-import operator
 from typing import List, Optional, TypedDict, Annotated
 from pydantic import BaseModel, Field
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
@@ -8,9 +7,27 @@ class OpenFilesSchema(BaseModel):
     """Schema for the open_files tool."""
     file_paths: List[str] = Field(description="List of file paths to open, relative to the codebase root.")
 
+def merge_unique(existing: List[str], new: List[str]) -> List[str]:
+    """Reducer for all_files_opened: append only unseen paths.
+
+    operator.add re-copied the whole history and let duplicates pile up
+    every time the same file was reopened; this keeps the list deduped in
+    first-opened order and returns the existing list untouched when the
+    update adds nothing.
+    """
+    if not new:
+        return existing
+    seen = set(existing)
+    fresh = []
+    for fp in new:
+        if fp not in seen:
+            seen.add(fp)
+            fresh.append(fp)
+    return existing + fresh if fresh else existing
+
 class ChatState(TypedDict):
     messages: Annotated[List[HumanMessage | AIMessage | ToolMessage], add_messages]
-    all_files_opened: Annotated[List[str], operator.add]
+    all_files_opened: Annotated[List[str], merge_unique]
     kb_exploration_rounds: int = 0  # Track KB-specific exploration rounds
     generating_kb: bool = False     # Flag for KB generation mode
     knowledge_base: Optional[str] = None  # Store generated KB
@@ -3,8 +3,14 @@ from langchain_core.utils.function_calling import convert_to_openai_tool
 from typing import List
 from .models import OpenFilesSchema
 
+# The OpenAI-format schemas depend only on tool names, descriptions, and
+# arg schemas — not on the bound filesystem — so they are generated once
+# per process instead of per chatbot instance
+_openai_tools_cache = None
+
 def create_tools(filesystem):
     """Create and return the tools used by the chatbot."""
+    global _openai_tools_cache
     
     def open_files(file_paths: List[str]) -> str:
         """Open and return the contents of the specified files (up to 30000 chars each)."""
@@ -24,4 +30,6 @@ def create_tools(filesystem):
         )
     ]
     
-    return tools, [convert_to_openai_tool(t) for t in tools]
+    if _openai_tools_cache is None:
+        _openai_tools_cache = [convert_to_openai_tool(t) for t in tools]
+    return tools, _openai_tools_cache
@@ -1,6 +1,7 @@
+import functools
 import os
 import logging
-import boto3
+from botocore.config import Config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -14,10 +15,27 @@ BEDROCK_MODEL = "anthropic.claude-3-5-sonnet-20241022-v2:0"
 CODEBASE_PATH = "/Users/wuzhiche/Workspace/BTS"
 BATCH_SIZE = 8
 
-# Use boto3 to load credentials from ~/.aws/credentials default profile
-session = boto3.Session(profile_name="default")
-credentials = session.get_credentials()
-if credentials:
-    logger.info(f"Loaded credentials from ~/.aws/credentials: Access Key ID = {credentials.access_key[:4]}...")
-else:
-    logger.warning("No credentials found in ~/.aws/credentials. Configure via AWS CLI ('aws configure').")
+# Shared botocore config: a larger connection pool lets concurrent sessions
+# and parallel tool rounds reuse warm HTTPS connections instead of queueing
+# on the default pool of 10; adaptive retries back off under throttling.
+BOTO_CONFIG = Config(max_pool_connections=50, retries={"mode": "adaptive"})
+
+# Cap on in-flight Bedrock calls across the whole graph; parallel tool
+# rounds and summary map-reduce fan-out stay under the account RPM quota
+# instead of triggering 429 retry storms
+BEDROCK_MAX_CONCURRENCY = 8
+
+# Session construction parses the credentials file and imports boto3's
+# data models — a few hundred ms paid at import time even on runs that
+# never touch AWS. Deferred to the first caller that actually needs it.
+@functools.lru_cache(maxsize=1)
+def get_session():
+    """Load the boto3 session from the ~/.aws/credentials default profile."""
+    import boto3
+    session = boto3.Session(profile_name="default")
+    credentials = session.get_credentials()
+    if credentials:
+        logger.info(f"Loaded credentials from ~/.aws/credentials: Access Key ID = {credentials.access_key[:4]}...")
+    else:
+        logger.warning("No credentials found in ~/.aws/credentials. Configure via AWS CLI ('aws configure').")
+    return session
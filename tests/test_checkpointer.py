@@ -0,0 +1,66 @@
+"""Smoke test for the shared sqlite checkpointer.
+
+Streams one turn through a compiled graph from a background session loop
+(the way app.py drives the chatbot), then a second turn from a different
+loop, and reads state back synchronously from the main thread — the three
+access patterns the saver has to support at once.
+"""
+import asyncio
+import threading
+from typing import Annotated, TypedDict
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("langgraph.checkpoint.sqlite.aio")
+pytest.importorskip("langchain_aws")
+pytest.importorskip("botocore")
+
+
+def _run_on_fresh_loop(coro):
+    """Drive a coroutine from a dedicated loop thread, like a Streamlit session."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    try:
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout=30)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_streams_turns_across_loops_and_reads_state_sync(tmp_path):
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langgraph.graph import END, StateGraph
+    from langgraph.graph.message import add_messages
+
+    from chatbot.agent import _create_checkpointer
+
+    class State(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    def respond(state):
+        return {"messages": [AIMessage(content=f"reply {len(state['messages'])}")]}
+
+    builder = StateGraph(State)
+    builder.add_node("respond", respond)
+    builder.set_entry_point("respond")
+    builder.add_edge("respond", END)
+    checkpointer = _create_checkpointer(str(tmp_path / "checkpoints.sqlite"))
+    app = builder.compile(checkpointer=checkpointer)
+    config = {"configurable": {"thread_id": "smoke"}}
+
+    async def one_turn(text):
+        async for _msg, _metadata in app.astream(
+            {"messages": [HumanMessage(content=text)]},
+            config,
+            stream_mode="messages",
+        ):
+            pass
+
+    # Two turns from two different session loops against the same saver
+    _run_on_fresh_loop(one_turn("hello"))
+    _run_on_fresh_loop(one_turn("again"))
+
+    # Sync access from the script thread, as get_current_state() does
+    state = app.get_state(config)
+    contents = [m.content for m in state.values["messages"]]
+    assert contents == ["hello", "reply 1", "again", "reply 3"]